@@ -1,8 +1,9 @@
 import streamlit as st
 import numpy as np
 import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.colors import qualitative
 import math
-import random
 
 # =================================================
 # PAGE CONFIG
@@ -31,11 +32,139 @@ AP_MAST_HEIGHT = 1.0
 MAX_DISTANCE = 1500.0
 FREQ_MHZ = 5900.0
 
+# Beam edges are straight lines; 200 samples still give a hover
+# readout of the beam height along their whole length
+BEAM_X = np.linspace(1, MAX_DISTANCE, 200)
+
+# Beam fill polygon: out along the upper edge, back along the lower one
+BEAM_POLY_X = np.empty(2 * BEAM_X.size)
+BEAM_POLY_X[:BEAM_X.size] = BEAM_X
+BEAM_POLY_X[BEAM_X.size:] = BEAM_X[::-1]
+
 # Tapered telecom tower
 TOWER_BASE_WIDTH = 8.0
 TOWER_TOP_WIDTH = 3.0
 TOWER_SEGMENTS = 12
 
+# Trace colours pinned to the colour-cycle slots they had when the tower
+# was drawn as 36 separate traces (baseline trace order), so they don't
+# shift with the trace count. Under Streamlit the default template's
+# colorway holds theme placeholders that the frontend swaps per theme.
+COLORWAY = pio.templates[pio.templates.default].layout.colorway or qualitative.Plotly
+
+AP_MAST_COLOR = COLORWAY[37 % len(COLORWAY)]
+UPPER_BEAM_COLOR = COLORWAY[38 % len(COLORWAY)]
+LOWER_BEAM_COLOR = COLORWAY[39 % len(COLORWAY)]
+
+def cpe_mast_color(i):
+    # CPE masts followed the beam traces, interleaved with their markers
+    return COLORWAY[(41 + 2 * i) % len(COLORWAY)]
+
+# Tree row; fixed seed so trees stay put between reruns
+NUM_TREES = 7
+TREE_SEED = 0
+
+# Environment excess loss (IEEE-style abstraction)
+ENV_LOSS_DB = {
+    "Rural": 0.0,
+    "Suburban": 8.0,
+    "Urban": 15.0
+}
+
+# =================================================
+# RF MODELS
+# =================================================
+# Frequency-dependent part of FSPL (d in km, f in MHz)
+FSPL_CONST_DB = 32.44 + 20 * math.log10(FREQ_MHZ)
+
+def fspl(distance_m):
+    d_km = distance_m / 1000.0
+    return FSPL_CONST_DB + 20 * np.log10(d_km)
+
+# SNR thresholds (dB) and the MCS reached at or above each one
+SNR_THRESHOLDS = np.array([5.0, 8.0, 12.0, 16.0, 20.0, 25.0])
+MCS_LUT = np.array([0, 1, 3, 5, 7, 9, 11])
+
+# PHY rate at 20 MHz indexed by MCS (unused MCS indices map to 0)
+PHY_RATE_20MHZ = np.array([
+    8.6, 17.2, 0.0, 34.4, 0.0, 68.8,
+    0.0, 103.2, 0.0, 137.6, 0.0, 143.4
+])
+
+# DL/UL link budget for all CPEs at once (d, noise are float arrays)
+def link_budget(d, noise, ap_eirp, cpe_eirp, ap_gain, cpe_gain,
+                fade_margin, env_loss, bw_mhz, ap_height):
+    # Scalar terms are combined once so each array op runs only once
+    rx_dl_const = ap_eirp + cpe_gain
+    rx_ul_const = cpe_eirp + ap_gain
+    extra_loss = env_loss + fade_margin
+    bw_scale = bw_mhz / 20
+
+    d_3d = np.hypot(d, ap_height - CPE_HEIGHT)
+
+    path_loss = fspl(d_3d)
+    total_loss = path_loss + extra_loss
+
+    rssi_dl = rx_dl_const - total_loss
+    rssi_ul = rx_ul_const - total_loss
+
+    snr_dl = rssi_dl - noise
+    snr_ul = rssi_ul - noise
+
+    mcs_dl = MCS_LUT[np.searchsorted(SNR_THRESHOLDS, snr_dl, side="right")]
+    mcs_ul = MCS_LUT[np.searchsorted(SNR_THRESHOLDS, snr_ul, side="right")]
+
+    phy_dl = PHY_RATE_20MHZ[mcs_dl] * bw_scale
+    phy_ul = PHY_RATE_20MHZ[mcs_ul] * bw_scale
+
+    return d_3d, path_loss, rssi_dl, rssi_ul, mcs_dl, mcs_ul, phy_dl, phy_ul
+
+# =================================================
+# NUMERIC PIPELINE
+# =================================================
+# Plain helpers; the plot layers that call them are cached
+def compute_beam(ap_height, tilt):
+    theta_u = -(tilt - HALF_BW)
+    theta_l = -(tilt + HALF_BW)
+
+    y_u = ap_height + BEAM_X * math.tan(math.radians(theta_u))
+    y_l = ap_height + BEAM_X * math.tan(math.radians(theta_l))
+
+    poly_y = np.empty(2 * BEAM_X.size)
+    poly_y[:BEAM_X.size] = y_u
+    poly_y[BEAM_X.size:] = y_l[::-1]
+    return BEAM_X, y_u, y_l, BEAM_POLY_X, poly_y
+
+def compute_cpe_metrics(cpe_horizontal, cpe_noise,
+                        ap_eirp, cpe_eirp, ap_gain, cpe_gain,
+                        fade_margin, env_loss, bw_mhz, tdd_dl, ap_height):
+    dl_ratio = tdd_dl / 100
+    ul_ratio = (100 - tdd_dl) / 100
+
+    (d_3d, path_loss, rssi_dl, rssi_ul,
+     mcs_dl, mcs_ul, phy_dl, phy_ul) = link_budget(
+        np.asarray(cpe_horizontal, dtype=float),
+        np.asarray(cpe_noise, dtype=float),
+        ap_eirp, cpe_eirp, ap_gain, cpe_gain,
+        fade_margin, env_loss, bw_mhz, ap_height
+    )
+
+    return dict(
+        d_3d=d_3d, fspl=path_loss,
+        rssi_dl=rssi_dl, rssi_ul=rssi_ul,
+        mcs_dl=mcs_dl, mcs_ul=mcs_ul,
+        phy_dl=phy_dl, phy_ul=phy_ul,
+        eff_dl=phy_dl * dl_ratio,
+        eff_ul=phy_ul * ul_ratio,
+    )
+
+def tree_layout():
+    rng = np.random.default_rng(TREE_SEED)
+    x = np.linspace(180, MAX_DISTANCE - 180, NUM_TREES)
+    trunk = rng.uniform(1.2, 1.8, NUM_TREES)
+    canopy = rng.uniform(2.0, TREE_MAX_HEIGHT - trunk)
+    return x, trunk, canopy
+
 # =================================================
 # SIDEBAR – DEPLOYMENT
 # =================================================
@@ -79,14 +208,8 @@ fade_margin = st.sidebar.slider(
 )
 
 tdd_dl = st.sidebar.slider("TDD DL Ratio (%)", 50, 90, 70, 5)
-tdd_ul = 100 - tdd_dl
 
-# Environment excess loss (IEEE-style abstraction)
-ENV_LOSS = {
-    "Rural": 0.0,
-    "Suburban": 8.0,
-    "Urban": 15.0
-}[environment]
+ENV_LOSS = ENV_LOSS_DB[environment]
 
 # =================================================
 # CPE PLACEMENT & NOISE
@@ -117,197 +240,230 @@ for i in range(num_cpes):
         )
     )
 
-# =================================================
-# RF MODELS
-# =================================================
-def fspl(distance_m):
-    d_km = distance_m / 1000.0
-    return 32.44 + 20 * np.log10(d_km) + 20 * np.log10(FREQ_MHZ)
-
-def snr_to_mcs(snr):
-    if snr < 5: return 0
-    if snr < 8: return 1
-    if snr < 12: return 3
-    if snr < 16: return 5
-    if snr < 20: return 7
-    if snr < 25: return 9
-    return 11
-
-def mcs_to_phy(mcs, bw):
-    base = {
-        0: 8.6, 1: 17.2, 3: 34.4,
-        5: 68.8, 7: 103.2,
-        9: 137.6, 11: 143.4
-    }
-    return base.get(mcs, 0) * (bw / 20)
-
-# =================================================
-# GEOMETRY
-# =================================================
-theta_u = -(tilt - HALF_BW)
-theta_l = -(tilt + HALF_BW)
-
-x = np.linspace(1, MAX_DISTANCE, 2000)
-y_u = ap_height + x * np.tan(np.deg2rad(theta_u))
-y_l = ap_height + x * np.tan(np.deg2rad(theta_l))
-
 # =================================================
 # PLOT
 # =================================================
-fig = go.Figure()
-
-# Ground
-fig.add_trace(go.Scatter(x=[0, MAX_DISTANCE], y=[0, 0], line=dict(width=4), name="Ground"))
-
-# Trees (≤ 5 m)
-for t in np.linspace(180, MAX_DISTANCE - 180, 7):
-    trunk = random.uniform(1.2, 1.8)
-    canopy = random.uniform(2.0, TREE_MAX_HEIGHT - trunk)
-    fig.add_shape(type="rect", x0=t-0.5, x1=t+0.5, y0=0, y1=trunk,
-                  fillcolor="#7B4A12", line=dict(width=0))
-    fig.add_shape(type="circle", x0=t-2.0, x1=t+2.0,
-                  y0=trunk, y1=trunk+canopy,
-                  fillcolor="rgba(34,139,34,0.9)", line=dict(width=0))
-
-# =================================================
-# TAPERED ZIG-ZAG TELECOM TOWER
-# =================================================
-tower_heights = np.linspace(0, ap_height, TOWER_SEGMENTS + 1)
-
-for i in range(TOWER_SEGMENTS):
-    y0, y1 = tower_heights[i], tower_heights[i+1]
-    w0 = TOWER_BASE_WIDTH - (TOWER_BASE_WIDTH - TOWER_TOP_WIDTH) * (y0 / ap_height)
-    w1 = TOWER_BASE_WIDTH - (TOWER_BASE_WIDTH - TOWER_TOP_WIDTH) * (y1 / ap_height)
-
-    fig.add_trace(go.Scatter(
-        x=[-w0/2, -w1/2], y=[y0, y1],
-        line=dict(width=3, color="gray"), showlegend=False
-    ))
-    fig.add_trace(go.Scatter(
-        x=[w0/2, w1/2], y=[y0, y1],
-        line=dict(width=3, color="gray"), showlegend=False
-    ))
-
-    if i % 2 == 0:
-        fig.add_trace(go.Scatter(
-            x=[-w0/2, w1/2], y=[y0, y1],
-            line=dict(width=1.5, color="gray"), showlegend=False
-        ))
-    else:
-        fig.add_trace(go.Scatter(
-            x=[w0/2, -w1/2], y=[y0, y1],
-            line=dict(width=1.5, color="gray"), showlegend=False
-        ))
-
-# AP mast + panel
-fig.add_trace(go.Scatter(
-    x=[0,0], y=[ap_height, ap_height + AP_MAST_HEIGHT],
-    line=dict(width=4), showlegend=False
-))
-fig.add_shape(
-    type="rect",
-    x0=-1.1, x1=1.1,
-    y0=ap_height + AP_MAST_HEIGHT - 1.2,
-    y1=ap_height + AP_MAST_HEIGHT + 1.2,
-    fillcolor="black"
+# Column order matches cpe_customdata in cpe_layer()
+CPE_HOVERTEMPLATE = (
+    "<b>CPE %{customdata[0]}</b><br>"
+    "Distance: %{customdata[1]:.1f} m<br>"
+    "FSPL: %{customdata[2]:.1f} dB<br>"
+    "Env Loss: %{customdata[3]:.1f} dB<br>"
+    "Fade Margin: %{customdata[4]:.1f} dB<br>"
+    "RSSI DL: %{customdata[5]:.1f} dBm<br>"
+    "RSSI UL: %{customdata[6]:.1f} dBm<br>"
+    "MCS DL: %{customdata[7]}<br>"
+    "MCS UL: %{customdata[8]}<br>"
+    "DL PHY: %{customdata[9]:.1f} Mbps<br>"
+    "UL PHY: %{customdata[10]:.1f} Mbps<br>"
+    "Practical DL: %{customdata[11]:.1f} Mbps<br>"
+    "Practical UL: %{customdata[12]:.1f} Mbps"
+    "<extra></extra>"
 )
 
-# Beam
-fig.add_trace(go.Scatter(x=x, y=y_u, line=dict(dash="dash"), name="Upper Beam"))
-fig.add_trace(go.Scatter(x=x, y=y_l, name="Lower Beam"))
-fig.add_trace(go.Scatter(
-    x=np.concatenate([x, x[::-1]]),
-    y=np.concatenate([y_u, y_l[::-1]]),
-    fill="toself",
-    fillcolor="rgba(0,100,255,0.15)",
-    line=dict(width=0),
-    name="10° Beam"
-))
-
-# =================================================
-# BUILDINGS + CPEs (up to 16)
-# =================================================
-for i, d in enumerate(cpe_horizontal):
-
-    fig.add_shape(
-        type="rect",
-        x0=d-14, x1=d+14,
-        y0=0, y1=HOUSE_HEIGHT,
-        fillcolor="#E6E6E6", line=dict(width=1)
-    )
-    fig.add_shape(
-        type="rect",
-        x0=d-14, x1=d+14,
-        y0=HOUSE_HEIGHT-0.4, y1=HOUSE_HEIGHT,
-        fillcolor="#B0B0B0", line=dict(width=0)
-    )
-
-    fig.add_trace(go.Scatter(
-        x=[d,d], y=[HOUSE_HEIGHT, CPE_HEIGHT],
-        mode="lines", line=dict(width=3), showlegend=False
-    ))
-
-    fig.add_shape(
+# Each layer returns (traces, shapes) as plain dicts and is cached on
+# only the inputs it draws from, so a widget change rebuilds one layer.
+# CPE inputs are tuples so the cache can hash them.
+@st.cache_data
+def scenery_layer():
+    traces = []
+    shapes = []
+
+    # Ground
+    traces.append(dict(type="scatter", x=[0, MAX_DISTANCE], y=[0, 0], line=dict(width=4), name="Ground"))
+
+    # Trees (≤ 5 m)
+    tree_x, tree_trunk, tree_canopy = tree_layout()
+
+    for t, trunk, canopy in zip(tree_x, tree_trunk, tree_canopy):
+        shapes.append(dict(type="rect", x0=t-0.5, x1=t+0.5, y0=0, y1=trunk,
+                           fillcolor="#7B4A12", line=dict(width=0)))
+        shapes.append(dict(type="circle", x0=t-2.0, x1=t+2.0,
+                           y0=trunk, y1=trunk+canopy,
+                           fillcolor="rgba(34,139,34,0.9)", line=dict(width=0)))
+
+    return traces, shapes
+
+@st.cache_data
+def tower_layer(ap_height):
+    # Tapered zig-zag telecom tower
+    tower_heights = np.linspace(0, ap_height, TOWER_SEGMENTS + 1)
+    half_widths = (
+        TOWER_BASE_WIDTH
+        - (TOWER_BASE_WIDTH - TOWER_TOP_WIDTH) * (tower_heights / ap_height)
+    ) / 2
+
+    # Rails and bracing as two traces, segments separated by NaN gaps
+    h0, h1 = half_widths[:-1], half_widths[1:]
+    y0, y1 = tower_heights[:-1], tower_heights[1:]
+    gap = np.full(TOWER_SEGMENTS, np.nan)
+
+    rail_x = np.stack([-h0, -h1, gap, h0, h1, gap], axis=1).ravel()
+    rail_y = np.stack([y0, y1, gap, y0, y1, gap], axis=1).ravel()
+
+    # Bracing zig-zags: left-to-right on even segments, right-to-left on odd
+    side = np.where(np.arange(TOWER_SEGMENTS) % 2 == 0, 1.0, -1.0)
+    brace_x = np.stack([-side * h0, side * h1, gap], axis=1).ravel()
+    brace_y = np.stack([y0, y1, gap], axis=1).ravel()
+
+    traces = [
+        dict(
+            type="scatter",
+            x=rail_x, y=rail_y, mode="lines",
+            line=dict(width=3, color="gray"), showlegend=False
+        ),
+        dict(
+            type="scatter",
+            x=brace_x, y=brace_y, mode="lines",
+            line=dict(width=1.5, color="gray"), showlegend=False
+        ),
+        # AP mast + panel
+        dict(
+            type="scatter",
+            x=[0,0], y=[ap_height, ap_height + AP_MAST_HEIGHT],
+            line=dict(width=4, color=AP_MAST_COLOR), showlegend=False
+        ),
+    ]
+    shapes = [dict(
         type="rect",
-        x0=d-1.4, x1=d-0.2,
-        y0=CPE_HEIGHT-0.4, y1=CPE_HEIGHT+0.4,
-        fillcolor="#2F4F4F"
-    )
-
-    d_3d = math.sqrt(d**2 + (ap_height - CPE_HEIGHT)**2)
-
-    total_loss = (
-        fspl(d_3d)
-        + ENV_LOSS
-        + fade_margin
+        x0=-1.1, x1=1.1,
+        y0=ap_height + AP_MAST_HEIGHT - 1.2,
+        y1=ap_height + AP_MAST_HEIGHT + 1.2,
+        fillcolor="black"
+    )]
+
+    return traces, shapes
+
+@st.cache_data
+def beam_layer(ap_height, tilt):
+    x, y_u, y_l, poly_x, poly_y = compute_beam(ap_height, tilt)
+
+    traces = [
+        dict(type="scatter", x=x, y=y_u, mode="lines",
+             line=dict(dash="dash", color=UPPER_BEAM_COLOR), name="Upper Beam"),
+        dict(type="scatter", x=x, y=y_l, mode="lines",
+             line=dict(color=LOWER_BEAM_COLOR), name="Lower Beam"),
+        dict(
+            type="scatter",
+            mode="lines",
+            x=poly_x,
+            y=poly_y,
+            fill="toself",
+            fillcolor="rgba(0,100,255,0.15)",
+            line=dict(width=0),
+            name="10° Beam"
+        ),
+    ]
+
+    return traces, []
+
+@st.cache_data
+def cpe_layer(cpe_horizontal, cpe_noise,
+              ap_eirp, cpe_eirp, ap_gain, cpe_gain,
+              fade_margin, env_loss, bw_mhz, tdd_dl, ap_height):
+    metrics = compute_cpe_metrics(
+        cpe_horizontal, cpe_noise,
+        ap_eirp, cpe_eirp, ap_gain, cpe_gain,
+        fade_margin, env_loss, bw_mhz, tdd_dl, ap_height
     )
 
-    rssi_dl = ap_eirp + cpe_gain - total_loss
-    rssi_ul = cpe_eirp + ap_gain - total_loss
+    traces = []
+    shapes = []
 
-    snr_dl = rssi_dl - cpe_noise[i]
-    snr_ul = rssi_ul - cpe_noise[i]
+    # Buildings + CPEs (up to 16)
+    for i, d in enumerate(cpe_horizontal):
 
-    mcs_dl = snr_to_mcs(snr_dl)
-    mcs_ul = snr_to_mcs(snr_ul)
+        shapes.append(dict(
+            type="rect",
+            x0=d-14, x1=d+14,
+            y0=0, y1=HOUSE_HEIGHT,
+            fillcolor="#E6E6E6", line=dict(width=1)
+        ))
+        shapes.append(dict(
+            type="rect",
+            x0=d-14, x1=d+14,
+            y0=HOUSE_HEIGHT-0.4, y1=HOUSE_HEIGHT,
+            fillcolor="#B0B0B0", line=dict(width=0)
+        ))
 
-    phy_dl = mcs_to_phy(mcs_dl, bw_mhz)
-    phy_ul = mcs_to_phy(mcs_ul, bw_mhz)
+        traces.append(dict(
+            type="scatter",
+            x=[d,d], y=[HOUSE_HEIGHT, CPE_HEIGHT],
+            mode="lines", line=dict(width=3, color=cpe_mast_color(i)),
+            showlegend=False
+        ))
 
-    eff_dl = phy_dl * (tdd_dl / 100)
-    eff_ul = phy_ul * (tdd_ul / 100)
+        shapes.append(dict(
+            type="rect",
+            x0=d-1.4, x1=d-0.2,
+            y0=CPE_HEIGHT-0.4, y1=CPE_HEIGHT+0.4,
+            fillcolor="#2F4F4F"
+        ))
 
-    fig.add_trace(go.Scatter(
-        x=[d], y=[CPE_HEIGHT],
+    # All CPE markers in one trace; hover text is formatted from customdata
+    n = len(cpe_horizontal)
+    cpe_customdata = np.column_stack([
+        np.arange(1, n + 1),
+        metrics["d_3d"], metrics["fspl"],
+        np.full(n, env_loss), np.full(n, fade_margin),
+        metrics["rssi_dl"], metrics["rssi_ul"],
+        metrics["mcs_dl"], metrics["mcs_ul"],
+        metrics["phy_dl"], metrics["phy_ul"],
+        metrics["eff_dl"], metrics["eff_ul"],
+    ])
+
+    traces.append(dict(
+        type="scatter",
+        x=cpe_horizontal, y=np.full(n, CPE_HEIGHT),
         mode="markers",
         marker=dict(size=6, color="black"),
-        hovertemplate=
-        f"<b>CPE {i+1}</b><br>"
-        f"Distance: {d_3d:.1f} m<br>"
-        f"FSPL: {fspl(d_3d):.1f} dB<br>"
-        f"Env Loss: {ENV_LOSS:.1f} dB<br>"
-        f"Fade Margin: {fade_margin:.1f} dB<br>"
-        f"RSSI DL: {rssi_dl:.1f} dBm<br>"
-        f"RSSI UL: {rssi_ul:.1f} dBm<br>"
-        f"MCS DL: {mcs_dl}<br>"
-        f"MCS UL: {mcs_ul}<br>"
-        f"DL PHY: {phy_dl:.1f} Mbps<br>"
-        f"UL PHY: {phy_ul:.1f} Mbps<br>"
-        f"Practical DL: {eff_dl:.1f} Mbps<br>"
-        f"Practical UL: {eff_ul:.1f} Mbps"
-        "<extra></extra>"
+        showlegend=False,
+        customdata=cpe_customdata,
+        hovertemplate=CPE_HOVERTEMPLATE
     ))
 
-# =================================================
-# LAYOUT
-# =================================================
-fig.update_layout(
-    height=900,
-    xaxis_title="Horizontal Distance from AP (m)",
-    yaxis_title="Height (m)",
-    xaxis=dict(range=[0, MAX_DISTANCE]),
-    yaxis=dict(range=[0, ap_height + 12]),
-    title="AP–CPE Vertical Coverage (Urban / Suburban / Rural + Fade Margin)"
+    return traces, shapes
+
+# Cached by identity: unchanged inputs reuse the same Figure object.
+# Only recent figures are kept; the inputs are continuous sliders and
+# cached resources live for the whole server process.
+@st.cache_resource(max_entries=8)
+def build_figure(ap_height, tilt, ap_eirp, cpe_eirp, ap_gain, cpe_gain,
+                 fade_margin, env_loss, bw_mhz, tdd_dl,
+                 cpe_horizontal, cpe_noise):
+    layers = [
+        scenery_layer(),
+        tower_layer(ap_height),
+        beam_layer(ap_height, tilt),
+        cpe_layer(
+            cpe_horizontal, cpe_noise,
+            ap_eirp, cpe_eirp, ap_gain, cpe_gain,
+            fade_margin, env_loss, bw_mhz, tdd_dl, ap_height
+        ),
+    ]
+
+    # Layer order sets the trace colour cycle and shape stacking
+    traces = [t for layer_traces, _ in layers for t in layer_traces]
+    shapes = [sh for _, layer_shapes in layers for sh in layer_shapes]
+
+    fig = go.Figure(
+        data=traces,
+        layout=dict(
+            height=900,
+            shapes=shapes,
+            xaxis=dict(title="Horizontal Distance from AP (m)",
+                       range=[0, MAX_DISTANCE]),
+            yaxis=dict(title="Height (m)", range=[0, ap_height + 12]),
+            title="AP–CPE Vertical Coverage (Urban / Suburban / Rural + Fade Margin)"
+        )
+    )
+
+    return fig
+
+fig = build_figure(
+    ap_height, tilt, ap_eirp, cpe_eirp, ap_gain, cpe_gain,
+    fade_margin, ENV_LOSS, bw_mhz, tdd_dl,
+    tuple(cpe_horizontal), tuple(cpe_noise)
 )
 
 st.plotly_chart(fig, use_container_width=True)